@@ -182,7 +182,6 @@
                 pkgs.zfs
                 python.pkgs.attrs
                 python.pkgs.click
-                python.pkgs.multimethod
                 python.pkgs.setuptools
                 python.pkgs.structlog
               ];
@@ -11,6 +11,8 @@ import rift.replication
 from rift.commands import SystemRunner
 from rift.datasets import Dataset, Remote
 
+log = structlog.get_logger()
+
 runner = SystemRunner()
 
 
@@ -118,7 +120,6 @@ def verbose_option(**kwargs):
 @contextmanager
 def error_handler():
     # handle errors: print to stderr and log.error
-    log = structlog.get_logger()
     try:
         yield  # everything inside the `with` block runs here
     except subprocess.CalledProcessError as e:
@@ -207,14 +208,17 @@ def send(
         remote = None if host is None else Remote(host, source_ssh_options)
         source = Dataset(path=path, remote=remote, runner=runner)
 
-        # find snapshot by name
-        snapshot = source.find(snapshot_name)
-
         # parse target
         host, path = target
         remote = None if host is None else Remote(host, target_ssh_options)
         target = Dataset(path=path, remote=remote, runner=runner)
 
+        # query both sides at once instead of one round trip after another
+        rift.replication.prefetch(source, target)
+
+        # find snapshot by name
+        snapshot = source.find(snapshot_name)
+
         pipes: list[tuple[str]] = [tuple(p.split(" ")) for p in pipes]
         return rift.replication.send(
             snapshot,
@@ -2,11 +2,14 @@ import asyncio
 import re
 from asyncio import create_subprocess_exec
 from asyncio.subprocess import PIPE
-from subprocess import PIPE
-from typing import Sequence
+from subprocess import PIPE, Popen
+from tempfile import TemporaryFile
+from typing import Iterator, Sequence
 
 import structlog
 
+log = structlog.get_logger()
+
 
 class SubprocessError(Exception):
     def __init__(self, message, cmd):
@@ -28,7 +31,18 @@ class DestinationFilesystemExists(SubprocessError):
         super().__init__(message, cmd)
 
 
+def classify(error: SubprocessError) -> SubprocessError:
+    """Maps a failed command to a more specific error based on its stderr output"""
+    if "dataset does not exist" in str(error):
+        return NoSuchDatasetError(str(error), error.cmd)
+    if re.match(".* destination '.*' exists", str(error)):
+        return DestinationFilesystemExists(str(error), error.cmd)
+    return error
+
+
 class Runner:
+    __slots__ = ()
+
     def run(self, command: Sequence[str], *others: Sequence[str]) -> str:
         """
         Run shell commands. If more than one command is provided, the commands will be piped and the output of the last command returned.
@@ -36,6 +50,12 @@ class Runner:
         """
         raise NotImplementedError
 
+    def iter_run(self, command: Sequence[str]) -> Iterator[str]:
+        """
+        Run a single shell command and yield its output line by line.
+        """
+        yield from self.run(command).splitlines()
+
 
 class SystemRunner(Runner):
     def run(self, command: Sequence[str], *others: Sequence[str]) -> str:
@@ -44,6 +64,22 @@ class SystemRunner(Runner):
         """
         return asyncio.run(self.main(command, *others))
 
+    def iter_run(self, command: Sequence[str]) -> Iterator[str]:
+        """
+        Run a single shell command and yield its output line by line as soon as it arrives, such that the lines can
+        be processed while the command is still running. Errors are raised after the last line.
+        """
+        log.debug(f"> {' '.join(command)}")
+        # stderr goes to a file instead of a pipe: a full stderr pipe would block the process while we wait on stdout
+        with TemporaryFile("w+") as stderr:
+            with Popen(command, stdout=PIPE, stderr=stderr, text=True) as process:
+                for line in process.stdout:
+                    yield line.rstrip("\n")
+            stderr.seek(0)
+            err = stderr.read()
+        if err.strip():
+            raise classify(SubprocessError(err, command))
+
     async def main(self, command: Sequence[str], *others: Sequence[str]) -> str:
         """
         Run shell commands. If more than one command is provided, the commands will be piped and the output of the last command returned.
@@ -77,8 +113,7 @@ class SystemRunner(Runner):
                 output.append(line.decode())
 
         commands = [command] + list(others)
-        log = structlog.get_logger()
-        log.debug("> " + " | ".join(map(" ".join, commands)))
+        log.debug(f"> {' | '.join(map(' '.join, commands))}")
 
         # create processes to run commands
         processes = [await create_subprocess_exec(*commands[0], stdout=PIPE, stderr=PIPE)]
@@ -115,11 +150,6 @@ class SystemRunner(Runner):
 
         # raise if there was an exception
         for e in errors:
-            if isinstance(e, SubprocessError):
-                if "dataset does not exist" in str(e):
-                    raise NoSuchDatasetError(str(e), e.cmd)
-                if re.match(".* destination '.*' exists", str(e)):
-                    raise DestinationFilesystemExists(str(e), e.cmd)
-            raise e
+            raise classify(e) if isinstance(e, SubprocessError) else e
 
         return "".join(output).strip()
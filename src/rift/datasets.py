@@ -1,16 +1,17 @@
-import re
-from functools import cache
+from functools import cache, wraps
+from itertools import chain
 from operator import attrgetter
-from shlex import split
-from typing import Collection, Optional, Sequence
+from string import Formatter
+from typing import Any, Callable, Collection, Optional, Sequence
 
 import structlog
 from attrs import field, frozen
-from multimethod import multimethod
 
 from rift.commands import NoSuchDatasetError, Runner
 from rift.snapshots import Bookmark, Snapshot
 
+log = structlog.get_logger()
+
 
 @frozen
 class Remote:
@@ -25,22 +26,46 @@ class Remote:
     options: tuple[str, ...] = ()
 
 
+@cache
 def ssh(remote: Optional[Remote]) -> tuple[str, ...]:
     """
     Builds an SSH command as a tuple of strings based on the provided remote details.
 
     This function generates a tuple representing the SSH command to connect to a
     given remote host. If the remote is not provided, it returns an empty tuple.
+    The result is cached since the same (frozen, hence hashable) remote is used for every command.
 
     :param remote: Optional remote connection configuration containing host and options.
     :return: A tuple of strings representing the constructed SSH command.
     """
     if remote is None:
         return ()
-    return ("ssh", remote.host) + sum((("-o", o) for o in remote.options), ()) + ("--",)
+    return ("ssh", remote.host, *chain.from_iterable(("-o", o) for o in remote.options), "--")
+
+
+def memoize[T](method: Callable[[Any], T]) -> Callable[[Any], T]:
+    """
+    Caches the result of a method without arguments in the `_caches` dict of the instance.
+
+    Unlike `functools.cache`, the cache lives and dies with the instance and does not create a reference cycle
+    through a bound method. Clearing `_caches` invalidates all memoized results.
+
+    :param method: The method to be memoized.
+    :return: The memoized method.
+    """
+
+    @wraps(method)
+    def wrapper(self) -> T:
+        try:
+            return self._caches[method.__name__]
+        except KeyError:
+            result = self._caches[method.__name__] = method(self)
+            return result
 
+    return wrapper
 
-@frozen(slots=False)
+
+@frozen
 class Stream:
     """
     Represents ZFS data stream i.e., the beginning of the ZFS send/recv pipe. For example,
@@ -53,24 +78,22 @@ class Stream:
 
     args: tuple[str, ...]
     runner: Runner
+    _caches: dict[str, Any] = field(factory=dict, init=False, repr=False, eq=False)
 
-    def __attrs_post_init__(self):
-        # instance-based caches since the @cache decorator operates on classes.
-        object.__setattr__(self, "size", cache(self.size))
-
+    @memoize
     def size(self) -> int:
         """Returns the estimated size of the stream in bytes"""
-        log = structlog.get_logger()
         log.debug("getting estimate of snapshot (stream) size")
         # get a size estimate by running the command in --dry-run mode and parsing output
-        output = self.runner.run(self.args + ("-P", "-n", "-v")).split("\n")[-1].strip()
-        m = re.match(r"size\s*(\d+)$", output)
-        if not m:
-            raise RuntimeError(f"cannot parse size form output '{output.strip()}'")
-        return int(m.group(1))
+        output = self.runner.run(self.args + ("-P", "-n", "-v")).rpartition("\n")[2].strip()
+        # the last line has the form "size<whitespace><bytes>"
+        parts = output.split()
+        if len(parts) != 2 or parts[0] != "size" or not parts[1].isdigit():
+            raise RuntimeError(f"cannot parse size form output '{output}'")
+        return int(parts[1])
 
 
-@frozen(slots=False)
+@frozen
 class Dataset:
     """
     Represents a backend for managing datasets, including functionalities for creating, sending, receiving, and
@@ -87,12 +110,7 @@ class Dataset:
     path: str
     remote: Optional[Remote] = None
     runner: Runner = field(kw_only=True)
-
-    def __attrs_post_init__(self):
-        # instance-based caches since the @cache decorator operates on classes.
-        object.__setattr__(self, "snapshots", cache(self.snapshots))
-        object.__setattr__(self, "bookmarks", cache(self.bookmarks))
-        object.__setattr__(self, "resume_token", cache(self.resume_token))
+    _caches: dict[str, Any] = field(factory=dict, init=False, repr=False, eq=False)
 
     @property
     def fqn(self):
@@ -105,10 +123,34 @@ class Dataset:
         """
         return f"{self.remote.host}:{self.path}" if self.remote is not None else self.path
 
+    @memoize
+    def _list(self) -> tuple[tuple[Snapshot, ...], tuple[Bookmark, ...]]:
+        """
+        Retrieves all snapshots and bookmarks for the given filesystem with a single `zfs list` command.
+
+        :raises RuntimeError: If the subprocess command fails during execution.
+        :raises NoSuchDatasetError: If the given filesystem does not exist.
+
+        :return: A tuple of all parsed `Snapshot` objects and a tuple of all parsed `Bookmark` objects, each sorted
+            by createtxg.
+        """
+        log.debug(f"retrieving snapshots and bookmarks for '{self.fqn}'")
+        args = ("zfs", "list", "-d", "1", "-pHt", "snapshot,bookmark", "-o", "name,guid,createtxg", self.path)
+        snapshots, bookmarks = [], []
+        # parse the lines while zfs is still listing; no lines if there are neither snapshots nor bookmarks
+        for line in self.runner.iter_run(ssh(self.remote) + args):
+            # only the name column can contain a "#", which separates the dataset from the bookmark name
+            if "#" in line:
+                bookmarks.append(Bookmark.parse(line))
+            else:
+                snapshots.append(Snapshot.parse(line))
+        by_createtxg = attrgetter("createtxg")
+        return tuple(sorted(snapshots, key=by_createtxg)), tuple(sorted(bookmarks, key=by_createtxg))
+
     def snapshots(self) -> tuple[Snapshot, ...]:
         """
-        Retrieves all snapshots for the given filesystem. The snapshots are obtained by
-        running a `zfs list` command.
+        Retrieves all snapshots for the given filesystem. The snapshots are obtained together with the bookmarks by
+        running a single `zfs list` command.
 
         :raises RuntimeError: If the subprocess command fails during execution.
         :raises NoSuchDatasetError: If the given filesystem does not exist.
@@ -116,17 +158,12 @@ class Dataset:
         :return: A tuple containing all parsed `Snapshot` objects from the retrieved
             snapshot data. If no snapshots exist, an empty tuple is returned.
         """
-        log = structlog.get_logger()
-        log.debug(f"retrieving snapshots for '{self.fqn}'")
-        args = split(f"zfs list -pHt snapshot -o name,guid,createtxg {self.path}")
-        result = self.runner.run(ssh(self.remote) + tuple(args))
-        snapshots = () if len(result) == 0 else tuple(map(Snapshot.parse, result.split("\n")))
-        return tuple(sorted(snapshots, key=attrgetter("createtxg")))
+        return self._list()[0]
 
     def bookmarks(self) -> tuple[Bookmark, ...]:
         """
-        Retrieves all bookmarks for the given filesystem. The bookmarks are obtained by
-        running a `zfs list` command.
+        Retrieves all bookmarks for the given filesystem. The bookmarks are obtained together with the snapshots by
+        running a single `zfs list` command.
 
         :raises RuntimeError: If the subprocess command fails during execution.
         :raises NoSuchDatasetError: If the given filesystem does not exist.
@@ -134,12 +171,17 @@ class Dataset:
         :return: A tuple containing all parsed `Bookmark` objects from the retrieved
             bookmark data. If no bookmarks exist, an empty tuple is returned.
         """
-        log = structlog.get_logger()
-        log.debug(f"retrieving bookmarks for '{self.fqn}'")
-        args = split(f"zfs list -pHt bookmark -o name,guid,createtxg {self.path}")
-        result = self.runner.run(ssh(self.remote) + tuple(args))
-        bookmarks = () if len(result) == 0 else tuple(map(Bookmark.parse, result.split("\n")))
-        return tuple(sorted(bookmarks, key=attrgetter("createtxg")))
+        return self._list()[1]
+
+    @memoize
+    def guids(self) -> frozenset[str]:
+        """
+        Returns the guids of all snapshots of the dataset for fast membership tests.
+
+        :raises NoSuchDatasetError: If the given filesystem does not exist.
+        :return: A frozenset containing the guids of all snapshots.
+        """
+        return frozenset(s.guid for s in self.snapshots())
 
     def find(self, name: str) -> Snapshot:
         """
@@ -153,13 +195,17 @@ class Dataset:
         :raises ValueError: If a snapshot with the specified name does not exist.
         :return: The snapshot with the specified name.
         """
-        log = structlog.get_logger()
         log.debug(f"finding snapshot '{name}' on '{self.fqn}'")
         try:
-            return next(s for s in self.snapshots() if s.name == name)
-        except StopIteration:
+            return self._snapshots_by_name()[name]
+        except KeyError:
             raise ValueError(f"No snapshot '{name}' in '{self.path}'")
 
+    @memoize
+    def _snapshots_by_name(self) -> dict[str, Snapshot]:
+        """Index of all snapshots by their name, e.g. `snap1`"""
+        return {s.name: s for s in self.snapshots()}
+
     def snapshot(self, name: str) -> None:
         """
         Create a snapshot for the given ZFS filesystem path.
@@ -168,9 +214,8 @@ class Dataset:
 
         :param name: The name to assign to the snapshot.
         """
-        log = structlog.get_logger()
         log.info(f"creating snapshot '{self.fqn}@{name}'")
-        self.cache_clear()  # invalidate caches
+        self._invalidate("_list", "guids", "_snapshots_by_name")  # new snapshot; bookmarks and resume token unchanged
         args = ("zfs", "snapshot", f"{self.path}@{name}")
         self.runner.run(ssh(self.remote) + args)
 
@@ -181,63 +226,59 @@ class Dataset:
 
         :param snapshot: The name of the snapshot to create a bookmark for without path@ prefix, e.g. snap1.
         """
-        log = structlog.get_logger()
         log.info(f"creating bookmark '{self.fqn}#{snapshot}'")
-        self.cache_clear()  # invalidate caches
+        self._invalidate("_list")  # new bookmark; the snapshots and their derived indices are unchanged
         args = ("zfs", "bookmark", f"{self.path}@{snapshot}", f"{self.path}#{snapshot}")
         self.runner.run(ssh(self.remote) + args)
 
+    @memoize
     def exists(self) -> bool:
         """
-        Determines whether the dataset exists.
+        Determines whether the dataset exists. Both outcomes are cached until the dataset is changed.
 
         :return: A boolean value indicating whether the dataset exists.
         """
         # This method checks for the presence of the dataset by attempting to retrieve
         # its snapshots. If the dataset does not exist, self.snapshots() raises a `NoSuchDatasetError`.
+        # The listing is needed anyway by every caller of exists(), so a separate probe would only add a round trip.
         try:
             self.snapshots()
             return True
         except NoSuchDatasetError:
             return False
 
-    @multimethod
-    def send(self, token: str, *, options: tuple[str, ...] = ()) -> Stream:
-        """
-        Constructs a resumeable ZFS send stream to a remote destination. It stores the first part of the pipe, e.g.
-        `ssh user@remote -- zfs send -t token` along with additional ZFS options.
-
-        :param token: The zfs resume token.
-        :param options: Additional options for the ZFS send command.
-        :return: A `Stream` object encapsulating the constructed ZFS send stream.
+    def send(
+        self,
+        snapshot: str | Snapshot,
+        ancestor: Optional[Snapshot | Bookmark] = None,
+        *,
+        options: tuple[str, ...] = (),
+    ) -> Stream:
         """
-        return Stream(ssh(self.remote) + ("zfs", "send", *options, "-t", token), self.runner)
+        Constructs a ZFS send stream to a remote destination. It stores the first part of the pipe along with
+        additional ZFS options. Depending on the arguments, the stream is
 
-    @multimethod
-    def send(self, snapshot: Snapshot, ancestor: Snapshot | Bookmark, *, options: tuple[str, ...] = ()) -> Stream:
-        """
-        Constructs an incremental ZFS send stream to a remote destination. It stores the first part of the pipe, e.g.
-        `ssh user@remote -- zfs send -i src/data@snap1 src/data@snap2` along with additional ZFS options.
+        - resumable if `snapshot` is a zfs resume token, e.g. `ssh user@remote -- zfs send -t token`,
+        - incremental if an `ancestor` is given, e.g. `ssh user@remote -- zfs send -i src/data@snap1 src/data@snap2`,
+        - full otherwise, e.g. `ssh user@remote -- zfs send src/data@snap1`.
 
-        :param snapshot: The ZFS snapshot to be sent.
+        :param snapshot: The ZFS snapshot to be sent or a zfs resume token.
         :param ancestor: The ZFS snapshot or bookmark indicating the ancestor snapshot for an incremental send.
         :param options: Additional options for the ZFS send command.
+        :raises TypeError: If the combination of arguments does not describe a valid send.
         :return: A `Stream` object encapsulating the constructed ZFS send stream.
         """
-        # use -i flag since we may want to filter intermediary snapshots
-        return Stream(ssh(self.remote) + ("zfs", "send", *options, "-i", ancestor.fqn, snapshot.fqn), self.runner)
-
-    @multimethod
-    def send(self, snapshot: Snapshot, *, options: tuple[str, ...] = ()) -> Stream:
-        """
-        Constructs a full ZFS send stream to a remote destination. It stores the first part of the pipe, e.g.
-        `ssh user@remote -- zfs send src/data@snap1` along with additional ZFS options.
-
-        :param snapshot: The ZFS snapshot to be sent.
-        :param options: Additional options for the ZFS send command.
-        :return: A `Stream` object encapsulating the constructed ZFS send stream.
-        """
-        return Stream(ssh(self.remote) + ("zfs", "send", *options, snapshot.fqn), self.runner)
+        match snapshot, ancestor:
+            case str() as token, None:
+                args = ("-t", token)
+            case Snapshot(), None:
+                args = (snapshot.fqn,)
+            case Snapshot(), Snapshot() | Bookmark():
+                # use -i flag since we may want to filter intermediary snapshots
+                args = ("-i", ancestor.fqn, snapshot.fqn)
+            case _:
+                raise TypeError(f"cannot send {snapshot!r} with ancestor {ancestor!r}")
+        return Stream(ssh(self.remote) + ("zfs", "send", *options, *args), self.runner)
 
     def recv(
         self,
@@ -260,11 +301,14 @@ class Dataset:
         self.cache_clear()  # invalidate caches
         # construct zfs recv command
         args = ssh(self.remote) + ("zfs", "receive", *options, self.path) + (("-n", "-v") if dry_run else ())
-        # replace templates in piped commands
-        pipes = [tuple(map(lambda arg: arg.format(size=stream.size()), pipe)) for pipe in pipes]
+        # replace templates in piped commands; estimate the stream size only if a pipe asks for it
+        fields = (name for pipe in pipes for arg in pipe for _, name, _, _ in Formatter().parse(arg))
+        size = stream.size() if "size" in fields else None
+        pipes = [tuple(arg.format(size=size) for arg in pipe) for pipe in pipes]
         # execute all commands (zfs send | pipe1 | pipe2 | zfs recv)
         self.runner.run(stream.args, *pipes, args)
 
+    @memoize
     def resume_token(self) -> Optional[str]:
         """
         Retrieve the resume token for a ZFS dataset.
@@ -274,7 +318,6 @@ class Dataset:
 
         :returns: The resume token as a string if it exists, otherwise None.
         """
-        log = structlog.get_logger()
         log.debug(f"looking for resume token on {self.fqn}")
         args = ("zfs", "get", "-H", "-o", "value", "receive_resume_token", self.path)
         result = self.runner.run(ssh(self.remote) + args)
@@ -291,18 +334,27 @@ class Dataset:
         if len(snapshots) == 0:
             return
 
-        self.cache_clear()  # invalidate caches
+        # a dry run does not change the dataset, hence caches stay valid
+        if not dry_run:
+            self._invalidate("_list", "guids", "_snapshots_by_name")  # snapshots gone; resume token unchanged
         # maps [s1,s2] to "source/A@s1,s2"
-        fqns = f"{self.path}@" + ",".join(snapshots)
+        fqns = f"{self.path}@{','.join(snapshots)}"
         # append -n and -v flags if dry_run is enabled
         args = ("zfs", "destroy") + (("-n", "-v") if dry_run else ()) + (fqns,)
         # execute destroy command (zfs destroy source/A@s1,s2)
         self.runner.run(ssh(self.remote) + args)
 
+    def _invalidate(self, *names: str) -> None:
+        """
+        Drops the memoized results of the given methods only, keeping everything a change did not affect.
+
+        :param names: The names of the memoized methods, e.g. `_list`.
+        """
+        for name in names:
+            self._caches.pop(name, None)
+
     def cache_clear(self):
         """
         Clears all cached properties of the object.
         """
-        getattr(self, "snapshots").cache_clear()
-        getattr(self, "bookmarks").cache_clear()
-        getattr(self, "resume_token").cache_clear()
+        self._caches.clear()
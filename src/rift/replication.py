@@ -1,5 +1,6 @@
+import heapq
 import re
-from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Sequence
 
 import structlog
@@ -7,6 +8,8 @@ import structlog
 from rift.datasets import Dataset
 from rift.snapshots import Bookmark, Snapshot
 
+log = structlog.get_logger()
+
 
 def sizeof_fmt(num: float, suffix: str = "B") -> str:
     """
@@ -28,6 +31,32 @@ def sizeof_fmt(num: float, suffix: str = "B") -> str:
     return f"{num:.1f}Yi{suffix}"
 
 
+def prefetch(source: Dataset, target: Dataset) -> None:
+    """
+    Retrieves the snapshots and bookmarks of the source and target dataset concurrently, followed by the resume
+    token of the target dataset if it exists. Every call waits mostly on `zfs` (possibly over ssh), hence running the
+    source and target side in separate threads overlaps their round trips. The results are memoized by the datasets,
+    so later calls return immediately.
+
+    Errors, e.g. a source dataset which does not exist, are raised once both sides are done. A target dataset which
+    does not exist yet is not an error.
+
+    :param source: The source `Dataset`.
+    :param target: The target `Dataset`.
+    """
+
+    def fetch_target():
+        # exists() caches a missing target, too; without a target there is no resume token to ask for
+        if target.exists():
+            target.resume_token()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = (executor.submit(source.snapshots), executor.submit(fetch_target))
+    # raise errors here instead of running the failing command a second time when its value is needed
+    for future in futures:
+        future.result()
+
+
 def ancestor(snapshot: Snapshot, source: Dataset, target: Dataset) -> Optional[Snapshot | Bookmark]:
     """
     Determines the common ancestor for the provided snapshot in the source and target datasets.
@@ -39,21 +68,23 @@ def ancestor(snapshot: Snapshot, source: Dataset, target: Dataset) -> Optional[S
     :return: A `Snapshot` or `Bookmark` instance representing the most recent common ancestor,
         or None if no ancestor exists.
     """
-    # consider only source snapshots/bookmarks which are older than snapshot.createtxg
-    candidates = filter(
-        lambda s: s.createtxg < snapshot.createtxg,
-        source.snapshots() + source.bookmarks(),
+    # snapshots() and bookmarks() are sorted by createtxg: merge them from newest to oldest, where snapshots take
+    # precedence over bookmarks with the same createtxg
+    candidates = heapq.merge(
+        reversed(source.snapshots()),
+        reversed(source.bookmarks()),
+        key=lambda s: (s.createtxg, isinstance(s, Snapshot)),
+        reverse=True,
     )
-    # sort by createtxg, but snapshots take precedence over bookmarks
-    candidates = sorted(candidates, key=lambda s: (s.createtxg, isinstance(s, Snapshot)))
 
-    # save target snapshot guids in a set for fast lookup
-    target_guids = {snap.guid: snap for snap in target.snapshots()}
+    # target snapshot guids as a set for fast lookup
+    target_guids = target.guids()
 
-    # go from the newest to oldest source snapshot, looking for a matching guid in the set of target snapshots
-    for snapshot in reversed(candidates):
-        if snapshot.guid in target_guids:
-            return snapshot  # common ancestor found!
+    # consider only source snapshots/bookmarks which are older than snapshot.createtxg and stop at the first
+    # one with a matching guid in the set of target snapshots
+    for candidate in candidates:
+        if candidate.createtxg < snapshot.createtxg and candidate.guid in target_guids:
+            return candidate  # common ancestor found!
     return None
 
 
@@ -81,10 +112,8 @@ def send(
     :param dry_run: Boolean flag to determine if the operation should be executed as a dry run.
     :raises FileNotFoundError: If the snapshot is not found in the source dataset.
     """
-    log = structlog.get_logger()
-
     # check if snapshot exists in source
-    if snapshot.guid not in map(attrgetter("guid"), source.snapshots()):
+    if snapshot.guid not in source.guids():
         raise FileNotFoundError(f"snapshot '{snapshot.fqn}' not in source '{source.fqn}'")
 
     # if the target dataset does not exist, send full snapshot
@@ -94,7 +123,7 @@ def send(
         return target.recv(stream, options=recv_options, pipes=pipes, dry_run=dry_run)
 
     # if the snapshot already exists on the target, skip send
-    if snapshot.guid in map(attrgetter("guid"), target.snapshots()):
+    if snapshot.guid in target.guids():
         log.info(f"rift send '{snapshot.fqn}' to '{target.fqn}' skipped since snapshot already on target")
         return None
 
@@ -143,16 +172,18 @@ def sync(
     :param regex: A regular expression pattern to filter which snapshots to be sent.
     :param dry_run: Boolean flag to determine if the operation should be executed as a dry run.
     """
-    log = structlog.get_logger()
     log.info(f"rift sync newer snapshots from '{source.fqn}' to '{target.fqn}'")
 
+    # query both sides at once instead of one round trip after another
+    prefetch(source, target)
+
     # if the target dataset does not exist or is empty, send all snapshots
     if not target.exists() or len(target.snapshots()) == 0:
         missing = source.snapshots()  # snapshots which are missing on target
         to_sync = missing  # snapshots to sync
     else:
         # find all snapshots in source that are not in target
-        missing = [s for s in source.snapshots() if s.guid not in map(attrgetter("guid"), target.snapshots())]
+        missing = [s for s in source.snapshots() if s.guid not in target.guids()]
 
         # get the guid of the latest snapshot on the target
         latest_guid = target.snapshots()[-1].guid
@@ -177,13 +208,14 @@ def sync(
     to_sync = [s for s in to_sync if p.match(s.name)]
     log.info(f"{len(to_sync)} snapshots need syncing")
 
-    # log the reason why snapshots are being synced or not
+    # log the reason why snapshots are being synced or not (guid sets for fast lookup)
+    to_sync_guids, missing_guids = {s.guid for s in to_sync}, {s.guid for s in missing}
     for s in source.snapshots():
-        if s in to_sync:
+        if s.guid in to_sync_guids:
             log.debug(f"[to be sync    ] {s.name}")
         elif not p.match(s.name):
             log.debug(f"[excluded      ] {s.name}")
-        elif s in missing:
+        elif s.guid in missing_guids:
             log.debug(f"[too old       ] {s.name}")
         else:
             log.debug(f"[already synced] {s.name}")
@@ -211,18 +243,18 @@ def prune(dataset: Dataset, policy: dict[str, int], *, dry_run: bool) -> None:
                    to retain as values. For example, `{"rift_.*_hourly": 24, "rift_.*_weekly": 7}`.
     :param dry_run: Boolean flag to determine if the operation should be executed as a dry run.
     """
-    log = structlog.get_logger()
+    # compile all patterns once before touching any snapshots
+    rules = [(regex, re.compile(regex).match, keep) for regex, keep in policy.items()]
 
     # collect all snapshots to delete
     obsolete = []
-    for regex, keep in policy.items():
+    for regex, match, keep in rules:
         # get all snapshots matching regex
-        p = re.compile(regex)
-        snapshots = [s for s in dataset.snapshots() if p.match(s.name)]
-        # retain the last n snapshots
-        retain = set(snapshots[-keep:]) if keep > 0 else {}
+        snapshots = [s for s in dataset.snapshots() if match(s.name)]
+        # retain the last n snapshots (identified by guid)
+        retain = {s.guid for s in snapshots[-keep:]} if keep > 0 else set()
         # delete everything that should not be retained
-        destroy = [s.name for s in snapshots if s not in retain]
+        destroy = [s.name for s in snapshots if s.guid not in retain]
         # collect all snapshots to then delete in a single zfs destroy command
         obsolete += destroy
 
@@ -232,7 +264,7 @@ def prune(dataset: Dataset, policy: dict[str, int], *, dry_run: bool) -> None:
 
         # create debug output
         for s in snapshots:
-            log.debug(f"{'[prune]' if s.name in destroy else '[keep ]'} {s.name}")
+            log.debug(f"{'[keep ]' if s.guid in retain else '[prune]'} {s.name}")
 
     # destroy snapshots
     dataset.destroy(obsolete, dry_run=dry_run)
@@ -1,9 +1,9 @@
-from attrs import frozen
+from attrs import field, frozen
 
 type guid = str
 
 
-@frozen
+@frozen(weakref_slot=False)
 class Snapshot:
     """
     Represents a ZFS snapshot.
@@ -16,20 +16,20 @@ class Snapshot:
     fqn: str
     guid: str
     createtxg: int
+    name: str = field(init=False, eq=False, repr=False)  # the name of the snapshot, e.g. `snap1`
+
+    def __attrs_post_init__(self):
+        # derive the name once; the class is frozen, hence object.__setattr__
+        object.__setattr__(self, "name", self.fqn.split("@")[1])
 
     @staticmethod
     def parse(line: str) -> "Snapshot":
         """Parses a snapshot line from `zfs list -pHt snapshot -o name,guid,createtxg`"""
-        parts = line.split()
+        parts = line.split(maxsplit=3)  # only the first three columns are used
         return Snapshot(parts[0], parts[1], int(parts[2]))
 
-    @property
-    def name(self) -> str:
-        """The name of the snapshot, e.g. `snap1`"""
-        return self.fqn.split("@")[1]
-
 
-@frozen
+@frozen(weakref_slot=False)
 class Bookmark:
     """
     Represents a ZFS bookmark.
@@ -42,14 +42,14 @@ class Bookmark:
     fqn: str
     guid: str
     createtxg: int
+    name: str = field(init=False, eq=False, repr=False)  # the name of the bookmark, e.g. `snap1`
+
+    def __attrs_post_init__(self):
+        # derive the name once; the class is frozen, hence object.__setattr__
+        object.__setattr__(self, "name", self.fqn.split("#")[1])
 
     @staticmethod
     def parse(line: str) -> "Bookmark":
         """Parses a snapshot line from `zfs list -pHt bookmark -o name,guid,createtxg`"""
-        parts = line.split()
+        parts = line.split(maxsplit=3)  # only the first three columns are used
         return Bookmark(parts[0], parts[1], int(parts[2]))
-
-    @property
-    def name(self) -> str:
-        """The name of the snapshot, e.g. `snap1`"""
-        return self.fqn.split("#")[1]
@@ -0,0 +1,10 @@
+import logging
+
+import pytest
+import structlog
+
+
+@pytest.fixture(scope="session", autouse=True)
+def configure_logging():
+    # silence rift's info/debug output once for the whole test session
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
@@ -1,7 +1,7 @@
 import random
 from typing import Optional, Sequence
 
-from attrs import Factory, define
+from attrs import Factory, define, field
 
 from rift.commands import NoSuchDatasetError, Runner
 from rift.snapshots import Bookmark, Snapshot
@@ -15,35 +15,64 @@ def token2fqn(token: str) -> str:
     return bytes.fromhex(token).decode("utf-8")
 
 
-@define
+def render(entry: tuple[str, str, int]) -> str:
+    """Renders an entry as a line of `zfs list -pH -o name,guid,createtxg`"""
+    return "\t".join(map(str, entry))
+
+
+def remove_remote(command: Sequence[str]) -> list[str]:
+    """Strips the `ssh user@host [-o option ...] --` prefix from a command"""
+    command = list(command)
+    return command[command.index("--") + 1 :] if command[0] == "ssh" else command
+
+
+@define(slots=True, eq=False)
 class InMemoryDataset:
     path: str  # e.g. pool/A
     remote: Optional[str] = None  # e.g. user@remote
     token: Optional[str] = None  # resume token for zfs send
-    data: dict[str, str] = Factory(dict)  # fqn -> zfs list entry
-    createtxg: int = 0  # zfs transaction id
-    rng: random.Random = None
-
-    def __attrs_post_init__(self):
-        self.rng = random.Random(self.path)
-        # simulate that zfs transaction ids are not unique across hosts
-        self.createtxg = self.rng.randint(0, 1000)
+    data: dict[str, tuple[str, str, int]] = Factory(dict)  # fqn -> (fqn, guid, createtxg)
+    createtxg: Optional[int] = None  # zfs transaction id, randomly initialized on first use
+    _rng: Optional[random.Random] = field(default=None, init=False, repr=False)
+    _snapshot_lines: Optional[tuple[str, ...]] = field(default=None, init=False, repr=False)  # cached listing
+    _bookmark_lines: Optional[tuple[str, ...]] = field(default=None, init=False, repr=False)  # cached listing
+
+    @property
+    def rng(self) -> random.Random:
+        # created lazily since empty datasets never need one
+        if self._rng is None:
+            self._rng = random.Random(self.path)
+        return self._rng
+
+    def next_createtxg(self, count: int = 1) -> int:
+        """Advances the zfs transaction id by count and returns the first new id"""
+        if self.createtxg is None:
+            # simulate that zfs transaction ids are not unique across hosts
+            self.createtxg = self.rng.randint(0, 1000)
+        self.createtxg += count
+        return self.createtxg - count + 1
 
     def find(self, fqn: str) -> Snapshot | Bookmark:
         if fqn not in self.data:
             raise RuntimeError(f"snapshot {fqn} does not exist")
-        return Snapshot.parse(self.data[fqn]) if "@" in fqn else Bookmark.parse(self.data[fqn])
+        return Snapshot(*self.data[fqn]) if "@" in fqn else Bookmark(*self.data[fqn])
 
     def snapshots(self) -> list[str]:
         """Returns all lines in the dataset that are snapshots"""
-        snapshots = list([line for line in self.data.values() if "@" in line.split()[0]])
-        self.rng.shuffle(snapshots)  # make sure rift does not depend on the order of snapshots returned by zfs
+        if self._snapshot_lines is None:
+            self._snapshot_lines = tuple(render(entry) for fqn, entry in self.data.items() if "@" in fqn)
+        snapshots = list(self._snapshot_lines)
+        if len(snapshots) > 1:
+            self.rng.shuffle(snapshots)  # make sure rift does not depend on the order of snapshots returned by zfs
         return snapshots
 
     def bookmarks(self) -> list[str]:
         """Returns all lines in the dataset that are bookmarks"""
-        bookmarks = list([line for line in self.data.values() if "#" in line.split()[0]])
-        self.rng.shuffle(bookmarks)  # make sure rift does not depend on the order of bookmarks returned by zfs
+        if self._bookmark_lines is None:
+            self._bookmark_lines = tuple(render(entry) for fqn, entry in self.data.items() if "#" in fqn)
+        bookmarks = list(self._bookmark_lines)
+        if len(bookmarks) > 1:
+            self.rng.shuffle(bookmarks)  # make sure rift does not depend on the order of bookmarks returned by zfs
         return bookmarks
 
     def snapshot(self, name: str, *other: str) -> "InMemoryDataset":
@@ -51,11 +80,9 @@ class InMemoryDataset:
         Create one or multiple snapshots for the dataset.
         :param name: The name for the snapshot, e.g. snap1
         """
-        for name in (name, *other):
-            self.createtxg += 1
-            fqn = f"{self.path}@{name}"
-            self.data[fqn] = f"{fqn}\tuuid:{fqn}\t{self.createtxg}"
-        return self
+        fqns = [f"{self.path}@{n}" for n in (name, *other)]
+        first = self.next_createtxg(len(fqns))
+        return self._register([(fqn, f"uuid:{fqn}", txg) for txg, fqn in enumerate(fqns, first)])
 
     def bookmark(self, snapshot_name: str, bookmark_name: str = None) -> "InMemoryDataset":
         """
@@ -67,15 +94,27 @@ class InMemoryDataset:
         fqn = f"{self.path}@{snapshot_name}"
         if fqn not in self.data:
             raise RuntimeError(f"snapshot {fqn} does not exist")
-        fqn, uuid, createtxg = self.data[fqn].split()
-        self.data[f"{self.path}#{bookmark_name}"] = f"{self.path}#{bookmark_name}\t{uuid}\t{createtxg}"
+        _, uuid, createtxg = self.data[fqn]
+        fqn = f"{self.path}#{bookmark_name}"
+        self.data[fqn] = (fqn, uuid, createtxg)
+        self._bookmark_lines = None
         return self
 
     def recv(self, snapshot: Snapshot) -> "InMemoryDataset":
         """Insert the received snapshot into the dataset."""
-        self.createtxg += 1
         fqn = f"{self.path}@{snapshot.name}"
-        self.data[fqn] = f"{fqn}\t{snapshot.guid}\t{self.createtxg}"
+        return self._register([(fqn, snapshot.guid, self.next_createtxg())])
+
+    def _register(self, entries: list[tuple[str, str, int]]) -> "InMemoryDataset":
+        """
+        Inserts new snapshot entries and keeps the cached listing up to date in the same pass.
+        :param entries: The entries to insert as (fqn, guid, createtxg)
+        """
+        if self._snapshot_lines is not None and not any(entry[0] in self.data for entry in entries):
+            self._snapshot_lines += tuple(map(render, entries))  # only new snapshots: extend the cached listing
+        else:
+            self._snapshot_lines = None  # an existing snapshot is replaced: rebuild the listing on next use
+        self.data.update((entry[0], entry) for entry in entries)
         return self
 
     def destroy(self, *snapshots: str) -> "InMemoryDataset":
@@ -83,20 +122,21 @@ class InMemoryDataset:
         Deletes specified snapshots from the dataset.
         :param snapshots: The names of the snapshots to be deleted e.g. snap1,snap2
         """
-        to_delete = {f"{self.path}@{snap}" for snap in snapshots}
-        for fqn in list(self.data.keys()):
-            if fqn in to_delete:
-                del self.data[fqn]
+        if not snapshots:
+            return self
+        for snap in snapshots:
+            self.data.pop(f"{self.path}@{snap}", None)
+        self._snapshot_lines = None
         return self
 
     def entries(self) -> list[str]:
         """
         Retrieves all snapshots/bookmarks.
         """
-        return [entry for entry in self.data.values()]
+        return [render(entry) for entry in self.data.values()]
 
 
-@define
+@define(slots=True, eq=False)
 class InMemoryFS(Runner):
     """
     Simulates an in-memory zfs file system for managing and manipulating datasets, aimed at
@@ -110,9 +150,11 @@ class InMemoryFS(Runner):
     def of(*datasets: InMemoryDataset):
         # to make it easier, identity datasets by path, ignoring remotes
         # hence, paths must be unique even though zfs allows multiple datasets with the same path on remotes
-        paths = [dataset.path for dataset in datasets]
-        assert len(paths) == len(set(paths)), "all datasets must have unique paths"
-        return InMemoryFS(dict(zip(paths, datasets)))
+        by_path = {}
+        for dataset in datasets:
+            assert dataset.path not in by_path, "all datasets must have unique paths"
+            by_path[dataset.path] = dataset
+        return InMemoryFS(by_path)
 
     def find(self, path: str, create_if_missing: bool = False) -> InMemoryDataset:
         if path not in self.datasets:
@@ -123,80 +165,81 @@ class InMemoryFS(Runner):
         return self.datasets[path]
 
     def run(self, command: Sequence[str], *others: Sequence[str]) -> str:
-        commands = [command] + list(others)
+        commands = (command, *others)
         self.recorded.append(" | ".join(map(" ".join, commands)))
 
-        def remove_remote(command):
-            return command[1:] if command[0] == "ssh" else command
-
-        # match zfs list snapshot
-        if "zfs list" in " ".join(command) and "snapshot" in command:
-            command = remove_remote(command)
-            path = command[-1]
-            return "\n".join(self.find(path).snapshots())
-
-        # match zfs list bookmark
-        if "zfs list" in " ".join(command) and "bookmark" in command:
-            command = remove_remote(command)
-            path = command[-1]
-            return "\n".join(self.find(path).bookmarks())
-
-        # match zfs snapshot
-        if "zfs snapshot" in " ".join(command):
-            command = remove_remote(command)
-            path, snapshot_name = command[-1].split("@")
-            self.find(path).snapshot(snapshot_name)
-            return ""
-
-        # match zfs snapshot
-        if "zfs bookmark" in " ".join(command):
-            command = remove_remote(command)
-            path, snapshot_name = command[-2].split("@")
-            path, bookmark_name = command[-1].split("#")
-            self.find(path).bookmark(snapshot_name, bookmark_name)
-            return ""
-
-        # match zfs send -t 23479 | zfs receive pool/B
-        if "zfs send" in " ".join(commands[0]) and "-t" in commands[0] and "zfs receive" in " ".join(commands[-1]):
-            send_command = remove_remote(commands[0])
-            fqn = token2fqn(send_command[-1])
-            src_path, snapshot_name = fqn.split("@")
-            dst_path = next((part for part in commands[-1] if "/" in part))  # find dataset path in commands
-            snapshot = self.find(src_path).find(fqn)
-            self.find(dst_path, create_if_missing=True).recv(snapshot)
-            return ""
-
         # match zfs send ... | zfs receive
-        if "zfs send" in " ".join(commands[0]) and "zfs receive" in " ".join(commands[-1]):
-            fqn = commands[0][-1]
-            src_path, snapshot_name = fqn.split("@")
-            dst_path = next((part for part in commands[-1] if "/" in part))  # find dataset path in commands
-            snapshot = self.find(src_path).find(fqn)
-            self.find(dst_path, create_if_missing=True).recv(snapshot)
-            return ""
-
+        if len(commands) > 1:
+            return self._send(remove_remote(commands[0]), commands[-1])
+
+        command = remove_remote(command)
+        handler = self._DISPATCH.get(tuple(command[:2]))
+        if handler is None:
+            raise NotImplementedError("> " + " | ".join(map(" ".join, commands)))
+        return handler(self, command)
+
+    def _list(self, command: Sequence[str]) -> str:
+        # match zfs list -pHt snapshot,bookmark ... pool/A
+        dataset = self.find(command[-1])
+        types = next(arg for arg in command if "snapshot" in arg or "bookmark" in arg).split(",")
+        if not set(types) <= {"snapshot", "bookmark"}:
+            raise NotImplementedError("> " + " ".join(command))
+        lines = (dataset.snapshots() if "snapshot" in types else []) + (
+            dataset.bookmarks() if "bookmark" in types else []
+        )
+        return "\n".join(lines)
+
+    def _snapshot(self, command: Sequence[str]) -> str:
+        # match zfs snapshot pool/A@s1
+        path, snapshot_name = command[-1].split("@")
+        self.find(path).snapshot(snapshot_name)
+        return ""
+
+    def _bookmark(self, command: Sequence[str]) -> str:
+        # match zfs bookmark pool/A@s1 pool/A#s1
+        path, snapshot_name = command[-2].split("@")
+        path, bookmark_name = command[-1].split("#")
+        self.find(path).bookmark(snapshot_name, bookmark_name)
+        return ""
+
+    def _send(self, send_command: Sequence[str], recv_command: Sequence[str]) -> str:
+        # match zfs send -t 23479 | zfs receive pool/B
+        # match zfs send ... | zfs receive pool/B
+        if send_command[:2] != ["zfs", "send"] or "zfs receive" not in " ".join(recv_command):
+            raise NotImplementedError("> " + " ".join(send_command) + " | " + " ".join(recv_command))
+        fqn = token2fqn(send_command[-1]) if "-t" in send_command else send_command[-1]
+        src_path, snapshot_name = fqn.split("@")
+        dst_path = next((part for part in recv_command if "/" in part))  # find dataset path in commands
+        snapshot = self.find(src_path).find(fqn)
+        self.find(dst_path, create_if_missing=True).recv(snapshot)
+        return ""
+
+    def _size(self, command: Sequence[str]) -> str:
         # match zfs send pool/A@s1 -P -n -v
-        if "zfs send" in " ".join(command):
-            return """full    pool/A@s1       3711767360\nsize    3711767360"""
+        return """full    pool/A@s1       3711767360\nsize    3711767360"""
 
+    def _get(self, command: Sequence[str]) -> str:
         # match zfs get receive_resume_token
-        if "receive_resume_token" in " ".join(command):
-            command = remove_remote(command)
-            path = command[-1]
-            return self.find(path).token
+        if "receive_resume_token" not in command:
+            raise NotImplementedError("> " + " ".join(command))
+        return self.find(command[-1]).token
 
+    def _destroy(self, command: Sequence[str]) -> str:
         # match zfs destroy pool/A@s1,s2
-        if "zfs destroy" in " ".join(command):
-            command = remove_remote(command)
-            path, snapshots = command[-1].split("@")
-            self.find(path).destroy(*snapshots.split(","))
-            return ""
-
-        raise NotImplementedError("> " + " | ".join(map(" ".join, commands)))
+        path, snapshots = command[-1].split("@")
+        self.find(path).destroy(*snapshots.split(","))
+        return ""
+
+    # dispatch table from the leading zfs subcommand to its handler; plain functions, hence no reference cycles
+    _DISPATCH = {
+        ("zfs", "list"): _list,
+        ("zfs", "snapshot"): _snapshot,
+        ("zfs", "bookmark"): _bookmark,
+        ("zfs", "send"): _size,
+        ("zfs", "get"): _get,
+        ("zfs", "destroy"): _destroy,
+    }
 
     def entries(self) -> list[str]:
         """Retrieves all snapshots/bookmarks from all datasets."""
         return [entry for dataset in self.datasets.values() for entry in dataset.entries()]
-
-    def __hash__(self):
-        return hash(id(self))
@@ -0,0 +1,46 @@
+from threading import Thread
+
+import pytest
+
+from rift.commands import NoSuchDatasetError, SubprocessError, SystemRunner
+
+
+def test_run_pipe():
+    assert SystemRunner().run(("printf", "a\\nb\\n"), ("tail", "-n", "1")) == "b"
+
+
+def test_iter_run():
+    assert list(SystemRunner().iter_run(("printf", "a\\nb\\n"))) == ["a", "b"]
+
+
+def test_iter_run_empty():
+    assert list(SystemRunner().iter_run(("true",))) == []
+
+
+def test_iter_run_error():
+    with pytest.raises(SubprocessError):
+        list(SystemRunner().iter_run(("sh", "-c", "echo failed >&2")))
+
+
+def test_iter_run_no_such_dataset():
+    with pytest.raises(NoSuchDatasetError):
+        list(SystemRunner().iter_run(("sh", "-c", "echo \"cannot open 'pool/A': dataset does not exist\" >&2")))
+
+
+def test_iter_run_large_stderr():
+    # more stderr than fits into a pipe buffer must neither block the command nor get lost
+    command = ("sh", "-c", 'head -c 200000 /dev/zero | tr "\\0" x >&2; echo ok')
+    errors = []
+
+    def consume():
+        try:
+            list(SystemRunner().iter_run(command))
+        except SubprocessError as e:
+            errors.append(e)
+
+    thread = Thread(target=consume, daemon=True)  # a daemon thread cannot keep a hanging test session alive
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert len(errors) == 1
+    assert errors[0].message.count("x") == 200000
@@ -1,24 +1,55 @@
-import logging
+import pytest
 
-import structlog
-from precisely import assert_that, contains_exactly, equal_to, includes
-
-from rift.datasets import Dataset, Remote, Stream
+from rift.datasets import Dataset, Remote, Stream, ssh
 from rift.snapshots import Bookmark, Snapshot
 from rift.tests.mocks import InMemoryDataset, InMemoryFS
 
-structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
-
 """
 This file contains low level tests; checking zfs shell commands.
 """
 
-
-def test_snapshot_list():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote"), runner=fs)
-    dataset.snapshots()
-    assert_that(fs.recorded, equal_to(["ssh user@remote -- zfs list -pHt snapshot -o name,guid,createtxg pool/A"]))
+# snapshots and bookmarks passed to the send tests; immutable and therefore shared
+S1 = Snapshot(fqn="pool/A@s1", guid="uuid:pool/A@s1", createtxg=1)
+S2 = Snapshot(fqn="pool/A@s2", guid="uuid:pool/A@s2", createtxg=2)
+B1 = Bookmark(fqn="pool/A#s1", guid="uuid:pool/A@s1", createtxg=1)
+
+# expected zfs send commands of the send tests
+SEND_RESUME = ("zfs", "send", "-w", "-t", "token")
+SEND_INCREMENTAL_FROM_SNAPSHOT = ("zfs", "send", "-i", "pool/A@s1", "pool/A@s2")
+SEND_INCREMENTAL_FROM_BOOKMARK = ("zfs", "send", "-i", "pool/A#s1", "pool/A@s2")
+SEND_FULL = ("zfs", "send", "-w", "pool/A@s2")
+
+
+@pytest.mark.parametrize(
+    "remote, prefix",
+    [
+        (None, ""),
+        (Remote("user@remote"), "ssh user@remote -- "),
+        (Remote("user@remote", ("Compression=yes",)), "ssh user@remote -o Compression=yes -- "),
+    ],
+)
+@pytest.mark.parametrize(
+    "method, args, command",
+    [
+        ("snapshots", (), "zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"),
+        ("bookmarks", (), "zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"),
+        ("snapshot", ("s2",), "zfs snapshot pool/A@s2"),
+        ("bookmark", ("s1",), "zfs bookmark pool/A@s1 pool/A#s1"),
+        ("resume_token", (), "zfs get -H -o value receive_resume_token pool/A"),
+    ],
+)
+def test_command(remote, prefix, method, args, command):
+    fs = InMemoryFS.of(InMemoryDataset("pool/A", remote and remote.host, token="341293104").snapshot("s1"))
+    dataset = Dataset(path="pool/A", remote=remote, runner=fs)
+    getattr(dataset, method)(*args)
+    assert fs.recorded == [prefix + command]
+
+
+def test_ssh():
+    assert ssh(None) == ()
+    assert ssh(Remote("user@remote", ("A=a", "B=b"))) == ("ssh", "user@remote", "-o", "A=a", "-o", "B=b", "--")
+    # equal remotes share the cached command
+    assert ssh(Remote("user@remote")) is ssh(Remote("user@remote"))
 
 
 def test_snapshot_list_caching():
@@ -26,24 +57,7 @@ def test_snapshot_list_caching():
     dataset = Dataset(path="pool/A", runner=fs)
     dataset.snapshots()
     dataset.snapshots()
-    assert_that(fs.recorded, equal_to(["zfs list -pHt snapshot -o name,guid,createtxg pool/A"]))
-
-
-def test_ssh_options():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote", ("Compression=yes",)), runner=fs)
-    dataset.snapshots()
-    assert_that(
-        fs.recorded,
-        equal_to(["ssh user@remote -o Compression=yes -- zfs list -pHt snapshot -o name,guid,createtxg pool/A"]),
-    )
-
-
-def test_bookmarks_list():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote"), runner=fs)
-    dataset.bookmarks()
-    assert_that(fs.recorded, equal_to(["ssh user@remote -- zfs list -pHt bookmark -o name,guid,createtxg pool/A"]))
+    assert fs.recorded == ["zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"]
 
 
 def test_bookmarks_list_caching():
@@ -51,40 +65,49 @@ def test_bookmarks_list_caching():
     dataset = Dataset(path="pool/A", runner=fs)
     dataset.bookmarks()
     dataset.bookmarks()
-    assert_that(fs.recorded, equal_to(["zfs list -pHt bookmark -o name,guid,createtxg pool/A"]))
+    assert fs.recorded == ["zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"]
+
+
+def test_snapshots_and_bookmarks_single_list():
+    fs = InMemoryFS.of(InMemoryDataset("pool/A").snapshot("s1", "s2").bookmark("s1"))
+    dataset = Dataset(path="pool/A", runner=fs)
+    assert [s.name for s in dataset.snapshots()] == ["s1", "s2"]
+    assert [b.name for b in dataset.bookmarks()] == ["s1"]
+    assert fs.recorded == ["zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"]
 
 
 def test_exists():
     fs = InMemoryFS.of(InMemoryDataset("pool/A"))
     dataset = Dataset(path="pool/A", runner=fs)
-    assert_that(dataset.exists(), equal_to(True))
+    assert dataset.exists()
 
 
 def test_exists_remote():
     fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote"))
     dataset = Dataset(path="pool/A", remote=Remote("user@remote", ("Compression=yes",)), runner=fs)
-    assert_that(dataset.exists(), equal_to(True))
+    assert dataset.exists()
 
 
 def test_not_exists():
     fs = InMemoryFS.of()
     dataset = Dataset(path="pool/AB", runner=fs)
-    assert_that(dataset.exists(), equal_to(False))
+    assert not dataset.exists()
 
 
-def test_snapshot():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A"))
+def test_not_exists_caching():
+    fs = InMemoryFS.of()
     dataset = Dataset(path="pool/A", runner=fs)
-    dataset.snapshot("s1")
-    assert_that(fs.recorded, equal_to(["zfs snapshot pool/A@s1"]))
-    assert_that(fs.entries(), contains_exactly("pool/A@s1\tuuid:pool/A@s1\t896"))
+    assert not dataset.exists()
+    assert not dataset.exists()
+    assert fs.recorded == ["zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A"]
 
 
-def test_snapshot_remote():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote", ("Compression=yes",)), runner=fs)
+def test_snapshot():
+    fs = InMemoryFS.of(InMemoryDataset("pool/A"))
+    dataset = Dataset(path="pool/A", runner=fs)
     dataset.snapshot("s1")
-    assert_that(fs.recorded, equal_to(["ssh user@remote -o Compression=yes -- zfs snapshot pool/A@s1"]))
+    assert fs.recorded == ["zfs snapshot pool/A@s1"]
+    assert sorted(fs.entries()) == ["pool/A@s1\tuuid:pool/A@s1\t896"]
 
 
 def test_bookmark():
@@ -92,48 +115,43 @@ def test_bookmark():
     fs = InMemoryFS.of(poolA.snapshot("s1"))
     dataset = Dataset(path="pool/A", runner=fs)
     dataset.bookmark("s1")
-    assert_that(fs.recorded, equal_to(["zfs bookmark pool/A@s1 pool/A#s1"]))
-    assert_that(fs.entries(), contains_exactly("pool/A@s1\tuuid:pool/A@s1\t896", "pool/A#s1\tuuid:pool/A@s1\t896"))
-
-
-def test_bookmark_remote():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", "user@remote").snapshot("s1"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote", ("Compression=yes",)), runner=fs)
-    dataset.bookmark("s1")
-    assert_that(fs.recorded, equal_to(["ssh user@remote -o Compression=yes -- zfs bookmark pool/A@s1 pool/A#s1"]))
+    assert fs.recorded == ["zfs bookmark pool/A@s1 pool/A#s1"]
+    assert sorted(fs.entries()) == ["pool/A#s1\tuuid:pool/A@s1\t896", "pool/A@s1\tuuid:pool/A@s1\t896"]
 
 
 def test_send_resume():
     fs = InMemoryFS.of()
     dataset = Dataset(path="pool/A", runner=fs)
     stream = dataset.send("token", options=("-w",))
-    assert_that(stream, equal_to(Stream(("zfs", "send", "-w", "-t", "token"), fs)))
+    assert stream == Stream(SEND_RESUME, fs)
 
 
 def test_send_incremental_from_snapshot():
     fs = InMemoryFS.of()
     dataset = Dataset(path="pool/A", runner=fs)
-    anchor = Snapshot(fqn="pool/A@s1", guid="uuid:pool/A@s1", createtxg=1)
-    snapshot = Snapshot(fqn="pool/A@s2", guid="uuid:pool/A@s2", createtxg=2)
-    stream = dataset.send(snapshot, anchor)
-    assert_that(stream, equal_to(Stream(("zfs", "send", "-i", "pool/A@s1", "pool/A@s2"), fs)))
+    stream = dataset.send(S2, S1)
+    assert stream == Stream(SEND_INCREMENTAL_FROM_SNAPSHOT, fs)
 
 
 def test_send_incremental_from_bookmark():
     fs = InMemoryFS.of()
     dataset = Dataset(path="pool/A", runner=fs)
-    anchor = Bookmark(fqn="pool/A#s1", guid="uuid:pool/A@s1", createtxg=1)
-    snapshot = Snapshot(fqn="pool/A@s2", guid="uuid:pool/A@s2", createtxg=2)
-    stream = dataset.send(snapshot, anchor)
-    assert_that(stream, equal_to(Stream(("zfs", "send", "-i", "pool/A#s1", "pool/A@s2"), fs)))
+    stream = dataset.send(S2, B1)
+    assert stream == Stream(SEND_INCREMENTAL_FROM_BOOKMARK, fs)
 
 
 def test_send_full():
     fs = InMemoryFS.of()
     dataset = Dataset(path="pool/A", runner=fs)
-    snapshot = Snapshot(fqn="pool/A@s2", guid="uuid:pool/A@s2", createtxg=2)
-    stream = dataset.send(snapshot, options=("-w",))
-    assert_that(stream, equal_to(Stream(("zfs", "send", "-w", "pool/A@s2"), fs)))
+    stream = dataset.send(S2, options=("-w",))
+    assert stream == Stream(SEND_FULL, fs)
+
+
+def test_send_invalid():
+    fs = InMemoryFS.of()
+    dataset = Dataset(path="pool/A", runner=fs)
+    with pytest.raises(TypeError):
+        dataset.send("token", S1)
 
 
 def test_recv():
@@ -145,15 +163,8 @@ def test_recv():
     snapshot = fs.find("pool/A").find("pool/A@s1")
     stream = source.send(snapshot)
     target.recv(stream, options=("-s", "-u", "-F"), dry_run=False)
-    assert_that(fs.recorded, equal_to(["zfs send pool/A@s1 | ssh user@remote -- zfs receive -s -u -F pool/B"]))
-    assert_that(fs.entries(), contains_exactly("pool/A@s1\tuuid:pool/A@s1\t896", "pool/B@s1\tuuid:pool/A@s1\t655"))
-
-
-def test_get_resume_token():
-    fs = InMemoryFS.of(InMemoryDataset("pool/A", remote="user@remote", token="341293104"))
-    dataset = Dataset(path="pool/A", remote=Remote("user@remote"), runner=fs)
-    dataset.resume_token()
-    assert_that(fs.recorded, equal_to(["ssh user@remote -- zfs get -H -o value receive_resume_token pool/A"]))
+    assert fs.recorded == ["zfs send pool/A@s1 | ssh user@remote -- zfs receive -s -u -F pool/B"]
+    assert sorted(fs.entries()) == ["pool/A@s1\tuuid:pool/A@s1\t896", "pool/B@s1\tuuid:pool/A@s1\t655"]
 
 
 def test_get_resume_token_caching():
@@ -161,7 +172,7 @@ def test_get_resume_token_caching():
     dataset = Dataset(path="pool/A", remote=Remote("user@remote"), runner=fs)
     dataset.resume_token()
     dataset.resume_token()
-    assert_that(fs.recorded, equal_to(["ssh user@remote -- zfs get -H -o value receive_resume_token pool/A"]))
+    assert fs.recorded == ["ssh user@remote -- zfs get -H -o value receive_resume_token pool/A"]
 
 
 def test_stream_size():
@@ -169,14 +180,14 @@ def test_stream_size():
     source = Dataset(path="pool/A", runner=fs)
     snapshot = fs.find("pool/A").find("pool/A@s1")
     stream = source.send(snapshot)
-    assert_that(stream.size(), equal_to(3711767360))
+    assert stream.size() == 3711767360
 
 
 def test_destroy_none():
     fs = InMemoryFS.of(InMemoryDataset("pool/A").snapshot("s1"))
     dataset = Dataset(path="pool/A", runner=fs)
     dataset.destroy([], dry_run=False)
-    assert_that(fs.recorded, equal_to([]))
+    assert fs.recorded == []
 
 
 def test_destroy():
@@ -184,8 +195,34 @@ def test_destroy():
     fs = InMemoryFS.of(poolA)
     dataset = Dataset(path="pool/A", runner=fs)
     dataset.destroy(["s1", "s2"], dry_run=False)
-    assert_that(fs.recorded, equal_to(["zfs destroy pool/A@s1,s2"]))
-    assert_that(fs.entries(), contains_exactly("pool/A@s3\tuuid:pool/A@s3\t897"))
+    assert fs.recorded == ["zfs destroy pool/A@s1,s2"]
+    assert sorted(fs.entries()) == ["pool/A@s3\tuuid:pool/A@s3\t897"]
+
+
+def test_destroy_dry_run_keeps_cache():
+    fs = InMemoryFS.of(InMemoryDataset("pool/A").snapshot("s1", "s2"))
+    dataset = Dataset(path="pool/A", runner=fs)
+    dataset.snapshots()
+    dataset.destroy(["s1"], dry_run=True)
+    dataset.snapshots()
+    assert fs.recorded == [
+        "zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A",
+        "zfs destroy -n -v pool/A@s1",
+    ]
+
+
+def test_bookmark_keeps_snapshot_index():
+    fs = InMemoryFS.of(InMemoryDataset("pool/A").snapshot("s1"))
+    dataset = Dataset(path="pool/A", runner=fs)
+    dataset.find("s1")
+    dataset.bookmark("s1")
+    dataset.find("s1")
+    dataset.bookmarks()
+    assert fs.recorded == [
+        "zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A",
+        "zfs bookmark pool/A@s1 pool/A#s1",
+        "zfs list -d 1 -pHt snapshot,bookmark -o name,guid,createtxg pool/A",
+    ]
 
 
 def test_send_rev():
@@ -201,7 +238,7 @@ def test_send_rev():
     target.recv(stream, dry_run=False)
 
     # assert that all options were passed through
-    assert_that(fs.recorded, includes("zfs send pool/A@s1 | zfs receive pool/B"))
+    assert "zfs send pool/A@s1 | zfs receive pool/B" in fs.recorded
 
 
 def test_send_rev_with_options():
@@ -217,12 +254,36 @@ def test_send_rev_with_options():
     target.recv(stream, options=("-s", "-u", "-F"), dry_run=False)
 
     # assert that all options were passed through
-    assert_that(
-        fs.recorded,
-        includes(
-            "ssh userA@remoteA -o option=A -- zfs send -w pool/A@s1 | ssh userB@remoteB -o option=B -- zfs receive -s -u -F pool/B"
-        ),
+    assert (
+        "ssh userA@remoteA -o option=A -- zfs send -w pool/A@s1 | ssh userB@remoteB -o option=B -- zfs receive -s -u -F pool/B"
+        in fs.recorded
+    )
+
+
+def test_recv_pipes_without_size():
+    poolA = InMemoryDataset("pool/A").snapshot("s1")
+    fs = InMemoryFS.of(poolA, InMemoryDataset("pool/B"))
+    source = Dataset(path="pool/A", runner=fs)
+    target = Dataset(path="pool/B", runner=fs)
+    target.recv(
+        source.send(poolA.find("pool/A@s1")), pipes=[("mbuffer", "-r", "1M"), ("awk", "{{print}}")], dry_run=False
     )
+    # no size estimate (zfs send -P -n -v) needed, but escaped braces are still formatted
+    assert fs.recorded == ["zfs send pool/A@s1 | mbuffer -r 1M | awk {print} | zfs receive pool/B"]
+
+
+@pytest.mark.parametrize("template", ["{size!s}", "{size:d}", "{size:>12}"])
+def test_recv_pipes_with_size_spec(template):
+    poolA = InMemoryDataset("pool/A").snapshot("s1")
+    fs = InMemoryFS.of(poolA, InMemoryDataset("pool/B"))
+    source = Dataset(path="pool/A", runner=fs)
+    target = Dataset(path="pool/B", runner=fs)
+    target.recv(source.send(poolA.find("pool/A@s1")), pipes=[("pv", "-s", template)], dry_run=False)
+    # conversions and format specs still ask for the size estimate
+    assert fs.recorded == [
+        "zfs send pool/A@s1 -P -n -v",
+        f"zfs send pool/A@s1 | pv -s {template.format(size=3711767360)} | zfs receive pool/B",
+    ]
 
 
 def test_send_rev_dry_run():
@@ -238,4 +299,4 @@ def test_send_rev_dry_run():
     target.recv(stream, dry_run=True)
 
     # assert that all options were passed through
-    assert_that(fs.recorded, includes("zfs send pool/A@s1 | zfs receive pool/B -n -v"))
+    assert "zfs send pool/A@s1 | zfs receive pool/B -n -v" in fs.recorded